@@ -60,11 +60,14 @@ def evaluate_model(
         )
 
         digit_acc = ((torch.argmax(a_pred, dim=1) == y_digit[:, 0]).sum() +
-                     (torch.argmax(b_pred, dim=1) == y_digit[:, 1]).sum()).item() / (2 * batch_size)
+                     (torch.argmax(b_pred, dim=1) == y_digit[:, 1]).sum()) / (2 * batch_size)
     else:
         digit_acc = float("nan")
 
-    acc = (((y_pred > 0.5) == y).sum() / batch_size).item()
+    # models trained with BCEWithLogitsLoss output logits, so their decision boundary is at 0 instead of 0.5
+    threshold = 0.0 if isinstance(loss_func, nn.BCEWithLogitsLoss) else 0.5
+    # the accuracies stay tensors on the device, calling .item() here would force a sync every batch
+    acc = ((y_pred > threshold) == y).sum() / batch_size
 
     return loss, acc, digit_acc
 
@@ -74,6 +77,7 @@ def train_model(
         optimizer: optim.Optimizer,
         loss_func: nn.Module, aux_loss_func: Optional[nn.Module], aux_weight: float,
         data: Data, epochs: int, batch_size: int,
+        use_amp: bool = False,
 ):
     """ Training the model
     The model is trained and evaluated at each epoch
@@ -86,13 +90,20 @@ def train_model(
     :param data: Data structures containing the data
     :param epochs: Number of epochs for training
     :param batch_size: Number of samples processed before updating the model, or -1 to use the entire dataset at once.
+    :param use_amp: Whether to run the forward passes in mixed precision, only takes effect on cuda.
     :return: Tensor containing the evaluation at each epoch + legends for plotting
     """
     if batch_size == -1:
         batch_size = len(data.train_x)
     batch_count = len(data.train_x) // batch_size
 
-    plot_data = torch.zeros(epochs, 6)
+    use_amp = use_amp and data.train_x.is_cuda
+    # the scaler keeps fp16 gradients from underflowing, it's a no-op when amp is disabled
+    scaler = torch.amp.GradScaler("cuda", enabled=use_amp)
+
+    # collect the stats on the training device and only move them to the cpu once at the end,
+    # so the loop never has to wait for the device inside an epoch
+    plot_data = torch.zeros(epochs, 6, device=data.train_x.device)
 
     for e in range(epochs):
         # train step
@@ -102,38 +113,43 @@ def train_model(
             batch_range = slice(bi * batch_size, (bi + 1) * batch_size)
 
             model.train()
-            batch_train_loss, _, _ = evaluate_model(
-                model,
-                data.train_x[batch_range], data.train_y[batch_range], data.train_y_float[batch_range],
-                data.train_digit[batch_range],
-                loss_func, aux_weight, aux_loss_func
-            )
+            with torch.autocast("cuda", enabled=use_amp):
+                batch_train_loss, _, _ = evaluate_model(
+                    model,
+                    data.train_x[batch_range], data.train_y[batch_range], data.train_y_float[batch_range],
+                    data.train_digit[batch_range],
+                    loss_func, aux_weight, aux_loss_func
+                )
 
             optimizer.zero_grad()
-            batch_train_loss.backward()
-            optimizer.step()
+            scaler.scale(batch_train_loss).backward()
+            scaler.step(optimizer)
+            scaler.update()
 
         # train evaluation
         model.eval()
-        train_loss, train_acc, train_digit_acc = evaluate_model(
-            model,
-            data.train_x, data.train_y, data.train_y_float, data.train_digit,
-            loss_func, aux_weight, aux_loss_func
-        )
+        with torch.autocast("cuda", enabled=use_amp):
+            train_loss, train_acc, train_digit_acc = evaluate_model(
+                model,
+                data.train_x, data.train_y, data.train_y_float, data.train_digit,
+                loss_func, aux_weight, aux_loss_func
+            )
 
         # test evaluation
         model.eval()
-        test_loss, test_acc, test_digit_acc = evaluate_model(
-            model,
-            data.test_x, data.test_y, data.test_y_float, data.test_digit,
-            loss_func, aux_weight, aux_loss_func
-        )
+        with torch.autocast("cuda", enabled=use_amp):
+            test_loss, test_acc, test_digit_acc = evaluate_model(
+                model,
+                data.test_x, data.test_y, data.test_y_float, data.test_digit,
+                loss_func, aux_weight, aux_loss_func
+            )
 
-        plot_data[e, :] = torch.tensor([
-            train_acc, train_digit_acc,
-            test_acc, test_digit_acc,
-            train_loss.item(), test_loss.item(),
-        ])
+        plot_data[e, 0] = train_acc
+        plot_data[e, 1] = train_digit_acc
+        plot_data[e, 2] = test_acc
+        plot_data[e, 3] = test_digit_acc
+        plot_data[e, 4] = train_loss.detach()
+        plot_data[e, 5] = test_loss.detach()
 
     plot_legend = "train_acc", "train_digit_acc", "test_acc", "test_digit_acc", "train_loss", "test_loss"
-    return plot_data, plot_legend
+    return plot_data.cpu(), plot_legend
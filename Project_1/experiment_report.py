@@ -1,12 +1,29 @@
+import torch
 from torch import nn
 
 from models import PreprocessModel, WeightShareModel, build_resnet, ProbOutputLayer
 from run_experiments import run_experiments, Experiment
+from util import get_device
 
 
-def build_simple_dense_model(dropout=0.0):
-    """Build a simple dense neural network, optionally with dropout layers with probability `dropout`."""
-    return nn.Sequential(
+def _compiled(model: nn.Module) -> nn.Module:
+    """
+    Compile `model` to cut the per-op dispatch overhead, which dominates for the small models used here.
+    On CPU the eager module is returned unchanged, which keeps debugging easy.
+    """
+    # check the selected device rather than cuda availability, select_device falls
+    # back to the cpu under a debugger even when cuda is present
+    if get_device() == "cuda":
+        return torch.compile(model, mode="reduce-overhead")
+    return model
+
+
+def build_simple_dense_model(dropout=0.0, sigmoid=False):
+    """
+    Build a simple dense neural network, optionally with dropout layers with probability `dropout`.
+    The model outputs logits, `sigmoid` appends a final sigmoid for losses that expect probabilities.
+    """
+    return _compiled(nn.Sequential(
         nn.Flatten(),
         nn.Linear(2 * 14 * 14, 64),
         nn.Dropout(dropout),
@@ -15,13 +32,13 @@ def build_simple_dense_model(dropout=0.0):
         nn.Dropout(dropout),
         nn.ReLU(),
         nn.Linear(32, 1),
-        nn.Sigmoid(),
-    )
+        *([nn.Sigmoid()] if sigmoid else []),
+    ))
 
 
 def build_simple_dense_model_smaller(dropout=0.0):
     """Build the same model as `build_simple_dense_model` but with smaller hidden layers"""
-    return nn.Sequential(
+    return _compiled(nn.Sequential(
         nn.Flatten(),
         nn.Linear(2 * 14 * 14, 32),
         nn.Dropout(dropout),
@@ -30,15 +47,14 @@ def build_simple_dense_model_smaller(dropout=0.0):
         nn.Dropout(dropout),
         nn.ReLU(),
         nn.Linear(16, 1),
-        nn.Sigmoid(),
-    )
+    ))
 
 
 EXPERIMENT_MSE = Experiment(
     name="Dense MSE",
     epochs=20,
     batch_size=100,
-    build_model=build_simple_dense_model,
+    build_model=lambda: build_simple_dense_model(sigmoid=True),
     build_loss=nn.MSELoss,
 )
 
@@ -47,7 +63,7 @@ EXPERIMENT_BCE = Experiment(
     epochs=20,
     batch_size=100,
     build_model=build_simple_dense_model,
-    build_loss=nn.BCELoss,
+    build_loss=nn.BCEWithLogitsLoss,
 )
 
 EXPERIMENT_BCE_SMALLER = Experiment(
@@ -55,7 +71,7 @@ EXPERIMENT_BCE_SMALLER = Experiment(
     epochs=20,
     batch_size=100,
     build_model=build_simple_dense_model_smaller,
-    build_loss=nn.BCELoss,
+    build_loss=nn.BCEWithLogitsLoss,
 )
 
 EXPERIMENT_BCE_REG = Experiment(
@@ -63,7 +79,7 @@ EXPERIMENT_BCE_REG = Experiment(
     epochs=20,
     batch_size=100,
     build_model=lambda: build_simple_dense_model(dropout=0.5),
-    build_loss=nn.BCELoss,
+    build_loss=nn.BCEWithLogitsLoss,
     weight_decay=0.8,
 )
 
@@ -75,68 +91,96 @@ def build_conv_model(
 ):
     """
     Build a convolutional model with a given number of input channels and a given output size.
-    If the output size is 1, the final activation is Sigmoid, otherwise it's Softmax.
+    If the output size is 1 the model outputs raw logits for use with `BCEWithLogitsLoss`,
+    otherwise the final activation is Softmax.
     Optionally include batch normalization after each hidden layer, and dropout layers after the convolutional
     or linear layers with given dropout probabilities.
     """
 
     if output_size == 1:
-        final_activation = nn.Sigmoid()
+        # raw logits, BCEWithLogitsLoss applies the sigmoid internally
+        final_activation = nn.Identity()
     else:
         final_activation = nn.Softmax(-1)
 
-    return nn.Sequential(
+    model = nn.Sequential(
         nn.Conv2d(input_channels, 16, (3, 3)),
         nn.Dropout(conv_dropout),
-        *[nn.BatchNorm2d(16)] * batch_norm,
+        *([nn.BatchNorm2d(16)] if batch_norm else []),
         nn.MaxPool2d((2, 2)),
         nn.Conv2d(16, 16, (3, 3)),
         nn.Dropout(conv_dropout),
-        *[nn.BatchNorm2d(16)] * batch_norm,
+        *([nn.BatchNorm2d(16)] if batch_norm else []),
         nn.MaxPool2d((2, 2)),
         nn.Flatten(),
         nn.Linear(2 * 2 * 16, 32),
         nn.Dropout(linear_dropout),
-        *[nn.BatchNorm1d(32)] * batch_norm,
+        *([nn.BatchNorm1d(32)] if batch_norm else []),
         nn.ReLU(),
         nn.Linear(32, output_size),
         final_activation
     )
 
+    # channels_last avoids the hidden NCHW<->NHWC transpose cuDNN does on every conv call
+    model = model.to(memory_format=torch.channels_last)
+
+    # only the input modules get compiled, the composite models keep their cheap output heads eager
+    return _compiled(model)
+
 
 EXPERIMENT_CONV = Experiment(
     name="Conv",
     epochs=80,
     build_model=lambda: build_conv_model(2, 1, False, 0.0, 0.0),
-    build_loss=nn.BCELoss,
+    build_loss=nn.BCEWithLogitsLoss,
+    channels_last=True,
+    amp=True,
 )
 EXPERIMENT_CONV_BN = Experiment(
     name="Conv + BatchNorm",
     epochs=80,
     build_model=lambda: build_conv_model(2, 1, True, 0.0, 0.0),
-    build_loss=nn.BCELoss,
+    build_loss=nn.BCEWithLogitsLoss,
+    channels_last=True,
+    amp=True,
 )
 EXPERIMENT_CONV_DROP = Experiment(
     name="Conv + Dropout",
     epochs=400,
     build_model=lambda: build_conv_model(2, 1, False, 0.1, 0.5),
-    build_loss=nn.BCELoss,
+    build_loss=nn.BCEWithLogitsLoss,
+    channels_last=True,
+    amp=True,
 )
 EXPERIMENT_CONV_DROP_BN = Experiment(
     name="Conv + BatchNorm + Dropout",
     epochs=160,
     build_model=lambda: build_conv_model(2, 1, True, 0.1, 0.5),
-    build_loss=nn.BCELoss,
+    build_loss=nn.BCEWithLogitsLoss,
+    channels_last=True,
+    amp=True,
 )
 
 EXPERIMENT_CONV_FLIP = Experiment(
     name="Conv + Flipped",
     epochs=80,
     build_model=lambda: build_conv_model(2, 1, False, 0.0, 0.0),
-    build_loss=nn.BCELoss,
+    build_loss=nn.BCEWithLogitsLoss,
     expand_flip=True,
+    channels_last=True,
+    amp=True,
 )
 
+def build_output_head():
+    """Build the small dense head that combines the two digit encodings, shared by all composite experiments."""
+    return nn.Sequential(
+        nn.Flatten(),
+        nn.Linear(20, 20),
+        nn.ReLU(),
+        nn.Linear(20, 1),
+    )
+
+
 EXPERIMENT_CONV_DUPLICATED = Experiment(
     name="Duplicated",
     epochs=20,
@@ -145,16 +189,12 @@ EXPERIMENT_CONV_DUPLICATED = Experiment(
     build_model=lambda: PreprocessModel(
         a_input_module=build_conv_model(1, 10, True, 0.1, 0.5),
         b_input_module=build_conv_model(1, 10, True, 0.1, 0.5),
-        output_head=nn.Sequential(
-            nn.Flatten(),
-            nn.Linear(20, 20),
-            nn.ReLU(),
-            nn.Linear(20, 1),
-            nn.Sigmoid(),
-        )
+        output_head=build_output_head()
     ),
 
-    build_loss=nn.BCELoss,
+    build_loss=nn.BCEWithLogitsLoss,
+    channels_last=True,
+    amp=True,
 )
 EXPERIMENT_CONV_SHARED = Experiment(
     name="Shared",
@@ -163,16 +203,12 @@ EXPERIMENT_CONV_SHARED = Experiment(
 
     build_model=lambda: WeightShareModel(
         input_module=build_conv_model(1, 10, True, 0.1, 0.5),
-        output_head=nn.Sequential(
-            nn.Flatten(),
-            nn.Linear(20, 20),
-            nn.ReLU(),
-            nn.Linear(20, 1),
-            nn.Sigmoid(),
-        )
+        output_head=build_output_head()
     ),
 
-    build_loss=nn.BCELoss,
+    build_loss=nn.BCEWithLogitsLoss,
+    channels_last=True,
+    amp=True,
 )
 
 AUX_EPOCHS = 70
@@ -185,18 +221,14 @@ EXPERIMENT_CONV_DUPLICATED_AUX = Experiment(
     build_model=lambda: PreprocessModel(
         a_input_module=build_conv_model(1, 10, True, 0.1, 0.5),
         b_input_module=build_conv_model(1, 10, True, 0.1, 0.5),
-        output_head=nn.Sequential(
-            nn.Flatten(),
-            nn.Linear(20, 20),
-            nn.ReLU(),
-            nn.Linear(20, 1),
-            nn.Sigmoid(),
-        )
+        output_head=build_output_head()
     ),
 
-    build_loss=nn.BCELoss,
+    build_loss=nn.BCEWithLogitsLoss,
     aux_weight=1,
     build_aux_loss=nn.NLLLoss,
+    channels_last=True,
+    amp=True,
 )
 EXPERIMENT_CONV_SHARED_AUX = Experiment(
     name="Shared Aux",
@@ -205,18 +237,14 @@ EXPERIMENT_CONV_SHARED_AUX = Experiment(
 
     build_model=lambda: WeightShareModel(
         input_module=build_conv_model(1, 10, True, 0.1, 0.5),
-        output_head=nn.Sequential(
-            nn.Flatten(),
-            nn.Linear(20, 20),
-            nn.ReLU(),
-            nn.Linear(20, 1),
-            nn.Sigmoid(),
-        )
+        output_head=build_output_head()
     ),
 
-    build_loss=nn.BCELoss,
+    build_loss=nn.BCEWithLogitsLoss,
     aux_weight=1,
     build_aux_loss=nn.NLLLoss,
+    channels_last=True,
+    amp=True,
 )
 EXPERIMENT_CONV_SHARED_AUX_LESS = Experiment(
     name="Shared Aux w0.1",
@@ -225,18 +253,14 @@ EXPERIMENT_CONV_SHARED_AUX_LESS = Experiment(
 
     build_model=lambda: WeightShareModel(
         input_module=build_conv_model(1, 10, True, 0.1, 0.5),
-        output_head=nn.Sequential(
-            nn.Flatten(),
-            nn.Linear(20, 20),
-            nn.ReLU(),
-            nn.Linear(20, 1),
-            nn.Sigmoid(),
-        )
+        output_head=build_output_head()
     ),
 
-    build_loss=nn.BCELoss,
+    build_loss=nn.BCEWithLogitsLoss,
     aux_weight=0.1,
     build_aux_loss=nn.NLLLoss,
+    channels_last=True,
+    amp=True,
 )
 EXPERIMENT_CONV_SHARED_AUX_MORE = Experiment(
     name="Shared Aux w10",
@@ -245,18 +269,14 @@ EXPERIMENT_CONV_SHARED_AUX_MORE = Experiment(
 
     build_model=lambda: WeightShareModel(
         input_module=build_conv_model(1, 10, True, 0.1, 0.5),
-        output_head=nn.Sequential(
-            nn.Flatten(),
-            nn.Linear(20, 20),
-            nn.ReLU(),
-            nn.Linear(20, 1),
-            nn.Sigmoid(),
-        )
+        output_head=build_output_head()
     ),
 
-    build_loss=nn.BCELoss,
+    build_loss=nn.BCEWithLogitsLoss,
     aux_weight=10,
     build_aux_loss=nn.NLLLoss,
+    channels_last=True,
+    amp=True,
 )
 EXPERIMENT_CONV_SHARED_AUX_MORE_MORE = Experiment(
     name="Shared Aux w100",
@@ -265,18 +285,14 @@ EXPERIMENT_CONV_SHARED_AUX_MORE_MORE = Experiment(
 
     build_model=lambda: WeightShareModel(
         input_module=build_conv_model(1, 10, True, 0.1, 0.5),
-        output_head=nn.Sequential(
-            nn.Flatten(),
-            nn.Linear(20, 20),
-            nn.ReLU(),
-            nn.Linear(20, 1),
-            nn.Sigmoid(),
-        )
+        output_head=build_output_head()
     ),
 
-    build_loss=nn.BCELoss,
+    build_loss=nn.BCEWithLogitsLoss,
     aux_weight=100,
     build_aux_loss=nn.NLLLoss,
+    channels_last=True,
+    amp=True,
 )
 
 EXPERIMENT_RESNET = Experiment(
@@ -285,19 +301,15 @@ EXPERIMENT_RESNET = Experiment(
     batch_size=100,
 
     build_model=lambda: WeightShareModel(
-        input_module=build_resnet(10, True),
-        output_head=nn.Sequential(
-            nn.Flatten(),
-            nn.Linear(20, 20),
-            nn.ReLU(),
-            nn.Linear(20, 1),
-            nn.Sigmoid(),
-        )
+        input_module=_compiled(build_resnet(10, True)),
+        output_head=build_output_head()
     ),
 
-    build_loss=nn.BCELoss,
+    build_loss=nn.BCEWithLogitsLoss,
     aux_weight=10,
     build_aux_loss=nn.NLLLoss,
+    channels_last=True,
+    amp=True,
 )
 
 EXPERIMENT_RESNET_RESLESS = Experiment(
@@ -306,19 +318,15 @@ EXPERIMENT_RESNET_RESLESS = Experiment(
     batch_size=100,
 
     build_model=lambda: WeightShareModel(
-        input_module=build_resnet(10, False),
-        output_head=nn.Sequential(
-            nn.Flatten(),
-            nn.Linear(20, 20),
-            nn.ReLU(),
-            nn.Linear(20, 1),
-            nn.Sigmoid(),
-        )
+        input_module=_compiled(build_resnet(10, False)),
+        output_head=build_output_head()
     ),
 
-    build_loss=nn.BCELoss,
+    build_loss=nn.BCEWithLogitsLoss,
     aux_weight=10,
     build_aux_loss=nn.NLLLoss,
+    channels_last=True,
+    amp=True,
 )
 
 EXPERIMENT_RESNET_RESLESS_PROB = Experiment(
@@ -327,13 +335,16 @@ EXPERIMENT_RESNET_RESLESS_PROB = Experiment(
     batch_size=100,
 
     build_model=lambda: WeightShareModel(
-        input_module=build_resnet(10, False),
+        input_module=_compiled(build_resnet(10, False)),
         output_head=ProbOutputLayer()
     ),
 
+    # ProbOutputLayer outputs an actual probability, so it keeps the plain BCE loss,
+    # which also means no amp since BCELoss is not autocast-safe
     build_loss=nn.BCELoss,
     aux_weight=10,
     build_aux_loss=nn.NLLLoss,
+    channels_last=True,
 )
 
 REPORT_EXPERIMENTS = [
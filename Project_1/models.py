@@ -158,7 +158,7 @@ def build_resnet(output_size: int, res: bool):
     `res` controls whether to enable the residual connections.
     """
 
-    return nn.Sequential(
+    model = nn.Sequential(
         nn.Conv2d(1, 32, (3, 3), padding=(1, 1)),
         nn.ReLU(),
 
@@ -178,6 +178,9 @@ def build_resnet(output_size: int, res: bool):
         nn.Softmax(-1),
     )
 
+    # channels_last avoids the hidden NCHW<->NHWC transpose cuDNN does on every conv call
+    return model.to(memory_format=torch.channels_last)
+
 
 class PreprocessModel(nn.Module):
     """
@@ -21,7 +21,7 @@ def main():
             i = c * rows + r
 
             ax = grid.axes_row[r][c]
-            ax.imshow(data.train_x[i, 0, :, :])
+            ax.imshow(data.train_x[i, 0, :, :].cpu())
 
     os.makedirs("output")
     pyplot.savefig("output/expanded_data.png")
@@ -4,6 +4,7 @@ This enables us to test different architectures with different settings for many
 """
 
 import os
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from math import prod
 from typing import Callable, Optional
@@ -13,7 +14,7 @@ from matplotlib import pyplot
 from torch import optim, nn
 
 from core import train_model
-from util import load_data, DEVICE, InputNormalization, set_plot_font_size
+from util import load_data, get_device, InputNormalization, set_plot_font_size
 
 
 @dataclass
@@ -39,6 +40,12 @@ class Experiment:
     expand_flip: bool = False
     input_normalization: InputNormalization = InputNormalization.No
 
+    # whether to store the input images in channels_last memory format, only useful for convolutional models
+    channels_last: bool = False
+
+    # whether to train in mixed precision, the loss has to be autocast-safe (eg. BCEWithLogitsLoss, not BCELoss)
+    amp: bool = False
+
     batch_size: int = -1
 
     def build(self):
@@ -47,6 +54,13 @@ class Experiment:
         return self.build_model(), self.build_loss(), None if self.build_aux_loss is None else self.build_aux_loss()
 
 
+def reset_parameters(model: nn.Module):
+    """ Re-initialize all parameters (and batch-norm statistics) of `model` in-place. """
+    for module in model.modules():
+        if hasattr(module, "reset_parameters"):
+            module.reset_parameters()
+
+
 def run_experiment(
         base_name: str,
         experiment: Experiment,
@@ -66,35 +80,56 @@ def run_experiment(
     all_plot_data = None
     plot_legend = None
 
+    model, loss_func, aux_loss_func = None, None, None
+
+    # generate the next round's data on a background thread while the current round trains,
+    # so the host-side data generation overlaps with the device-side training
+    executor = ThreadPoolExecutor(max_workers=1)
+    next_data = executor.submit(load_data, data_size, experiment.input_normalization)
+
     for round in range(rounds):
         print(f"Round {round + 1}/{rounds}")
 
-        data = load_data(data_size, experiment.input_normalization)
+        data = next_data.result()
+        if round + 1 < rounds:
+            next_data = executor.submit(load_data, data_size, experiment.input_normalization)
+
         if experiment.expand_flip:
             data.expand_train_flip()
         data.expand_train_transform(factor=experiment.expand_factor)
         data.shuffle_train()
-        data.to(DEVICE)
 
-        model, loss_func, aux_loss_func = experiment.build()
-        model.to(DEVICE)
+        if experiment.channels_last:
+            # match the model's memory format so no transposes happen during training
+            data.train_x = data.train_x.contiguous(memory_format=torch.channels_last)
+            data.test_x = data.test_x.contiguous(memory_format=torch.channels_last)
+
+        if model is None:
+            model, loss_func, aux_loss_func = experiment.build()
+            model.to(get_device())
 
-        if round == 0:
             weight_count = sum(prod(param.shape) for param in model.parameters() if param.requires_grad)
             print(f"Model has {weight_count} weights")
+        else:
+            # reuse the same module across rounds so compiled artifacts stay valid instead of
+            # recompiling a fresh model every round, re-initializing keeps the rounds independent
+            reset_parameters(model)
 
         optimizer = optim.AdamW(model.parameters(), weight_decay=experiment.weight_decay)
 
         plot_data, plot_legend = train_model(
             model=model, optimizer=optimizer, loss_func=loss_func, data=data,
             aux_loss_func=aux_loss_func, aux_weight=experiment.aux_weight,
-            epochs=experiment.epochs, batch_size=experiment.batch_size
+            epochs=experiment.epochs, batch_size=experiment.batch_size,
+            use_amp=experiment.amp,
         )
 
         if all_plot_data is None:
             all_plot_data = torch.empty((rounds,) + plot_data.shape)
         all_plot_data[round] = plot_data
 
+    executor.shutdown()
+
     # Filter out loss data TODO: what ?
     plot_mask = torch.tensor([plot_loss or not legend.endswith("_loss") for legend in plot_legend])
     all_plot_data = all_plot_data[:, :, plot_mask]
@@ -3,7 +3,7 @@ from dataclasses import dataclass, fields
 from enum import Enum, auto
 
 import torch
-from torchvision.transforms import RandomAffine, InterpolationMode
+from torchvision.transforms.v2 import RandomAffine, InterpolationMode
 
 from dlc_practical_prologue import generate_pair_sets
 
@@ -23,11 +23,29 @@ def select_device(debug_on_cpu: bool):
         if gettrace is not None and gettrace() is not None:
             device = "cpu"
 
+    if device == "cuda":
+        # our input shapes are fixed, so let cuDNN autotune its conv algorithms once,
+        # and allow TF32 which is plenty of precision for these experiments
+        torch.backends.cudnn.benchmark = True
+        torch.backends.cudnn.allow_tf32 = True
+        torch.backends.cuda.matmul.allow_tf32 = True
+
     print(f"Using device {device}")
     return device
 
 
-DEVICE = select_device(debug_on_cpu=True)
+_DEVICE = None
+
+
+def get_device():
+    """
+    Return the device all experiments run on, selecting it on first use.
+    Selecting lazily avoids touching cuda (and printing) as a side effect of importing this module.
+    """
+    global _DEVICE
+    if _DEVICE is None:
+        _DEVICE = select_device(debug_on_cpu=True)
+    return _DEVICE
 
 
 @dataclass
@@ -37,21 +55,44 @@ class Data:
     train_size: int
     train_x: torch.Tensor
     train_y: torch.Tensor
-    train_y_float: torch.Tensor
     train_digit: torch.Tensor
 
     test_size: int
     test_x: torch.Tensor
     test_y: torch.Tensor
-    test_y_float: torch.Tensor
     test_digit: torch.Tensor
 
+    def __post_init__(self):
+        self._train_y_float = None
+        self._train_y_float_src = None
+        self._test_y_float = None
+        self._test_y_float_src = None
+
+    @property
+    def train_y_float(self):
+        """ Float version of `train_y`, computed lazily and cached until `train_y` is replaced. """
+        if self._train_y_float_src is not self.train_y:
+            self._train_y_float = self.train_y.to(torch.float32)
+            self._train_y_float_src = self.train_y
+        return self._train_y_float
+
+    @property
+    def test_y_float(self):
+        """ Float version of `test_y`, computed lazily and cached until `test_y` is replaced. """
+        if self._test_y_float_src is not self.test_y:
+            self._test_y_float = self.test_y.to(torch.float32)
+            self._test_y_float_src = self.test_y
+        return self._test_y_float
+
     def to(self, device):
         """ Move all tensors to a different device. """
         for field in fields(self):
             value = getattr(self, field.name)
             if isinstance(value, torch.Tensor):
-                setattr(self, field.name, value.to(device))
+                if value.device.type == "cpu" and torch.device(device).type == "cuda":
+                    # pinning lets the copy run asynchronously
+                    value = value.pin_memory()
+                setattr(self, field.name, value.to(device, non_blocking=True))
 
     def expand_train_flip(self):
         """
@@ -59,11 +100,19 @@ class Data:
         This doubles the size of the train set.
         """
         same_digit = self.train_digit[:, 0] == self.train_digit[:, 1]
+        n = len(self.train_x)
+
+        def doubled(first, second):
+            # allocate the doubled tensor once and fill both halves in place,
+            # the same pattern as expand_train_transform
+            out = torch.empty((2 * n,) + first.shape[1:], device=first.device, dtype=first.dtype)
+            out[:n] = first
+            out[n:] = second
+            return out
 
-        self.train_x = torch.cat([self.train_x, self.train_x.flip(1)])
-        self.train_y = torch.cat([self.train_y, 1 - self.train_y + same_digit])
-        self.train_y_float = torch.cat([self.train_y_float, 1 - self.train_y_float + same_digit])
-        self.train_digit = torch.cat([self.train_digit, self.train_digit.flip(1)])
+        self.train_x = doubled(self.train_x, self.train_x.flip(1))
+        self.train_y = doubled(self.train_y, 1 - self.train_y + same_digit)
+        self.train_digit = doubled(self.train_digit, self.train_digit.flip(1))
 
     def expand_train_transform(self, factor: int):
         """
@@ -75,11 +124,20 @@ class Data:
 
         self.train_size *= factor
 
-        train_x_new = [transform(self.train_x) for _ in range(factor - 1)]
-        self.train_x = torch.cat([self.train_x] + train_x_new, dim=0)
+        n = len(self.train_x)
+
+        # allocate the expanded tensor once and fill it slice by slice,
+        # the transform runs on the full batch at a time (on the gpu if the data is there)
+        train_x_new = torch.empty(
+            (factor * n,) + self.train_x.shape[1:],
+            device=self.train_x.device, dtype=self.train_x.dtype
+        )
+        train_x_new[:n] = self.train_x
+        for i in range(1, factor):
+            train_x_new[i * n:(i + 1) * n] = transform(self.train_x)
+        self.train_x = train_x_new
 
         self.train_y = self.train_y.repeat(factor)
-        self.train_y_float = self.train_y_float.repeat(factor)
         # TODO: The 1 is not necessary right in the repeating
         self.train_digit = self.train_digit.repeat(factor, 1)
 
@@ -87,11 +145,19 @@ class Data:
         """
         Shuffle the train data, this is important when training is using minibatches.
         """
-        perm = torch.randperm(len(self.train_x))
-        self.train_x = self.train_x[perm]
-        self.train_y = self.train_y[perm]
-        self.train_y_float = self.train_y_float[perm]
-        self.train_digit = self.train_digit[perm]
+        # generate the permutation directly on the data's device, a cpu perm would force
+        # an implicit host->device copy for every gather below
+        perm = torch.randperm(len(self.train_x), device=self.train_x.device)
+
+        # index_select outputs a standard contiguous tensor, so re-apply the channels_last
+        # layout if the experiment chose it, otherwise the layout is lost after the first shuffle
+        channels_last = self.train_x.is_contiguous(memory_format=torch.channels_last)
+        self.train_x = self.train_x.index_select(0, perm)
+        if channels_last:
+            self.train_x = self.train_x.contiguous(memory_format=torch.channels_last)
+
+        self.train_y = self.train_y.index_select(0, perm)
+        self.train_digit = self.train_digit.index_select(0, perm)
 
 
 class InputNormalization(Enum):
@@ -105,11 +171,11 @@ class InputNormalization(Enum):
 
 def normalize(train_x, test_x, input_normalization: InputNormalization):
     """
-    Normalize the given data with the given mode.
+    Normalize the given data in-place with the given mode.
+    The statistics are computed on whatever device the data is on.
     """
     if input_normalization == InputNormalization.No:
-        std = torch.tensor(1)
-        mean = torch.tensor(0)
+        return
     elif input_normalization == InputNormalization.ElementWise:
         std, mean = torch.std_mean(train_x, dim=(0, 1))
     elif input_normalization == InputNormalization.Total:
@@ -119,19 +185,25 @@ def normalize(train_x, test_x, input_normalization: InputNormalization):
 
     std[std == 0] = 1
 
-    return (train_x - mean) / std, (test_x - mean) / std
+    train_x.sub_(mean).div_(std)
+    test_x.sub_(mean).div_(std)
 
 
 def load_data(data_size: int, input_normalization: InputNormalization = InputNormalization.No) -> Data:
     """ Load/generate training and test data with the given size and normalization mode. """
     train_x, train_y, train_digit, test_x, test_y, test_digit = generate_pair_sets(data_size)
 
-    train_x, test_x = normalize(train_x, test_x, input_normalization)
-
     data = Data(
-        train_x=train_x, train_y=train_y, train_y_float=train_y.float(), train_digit=train_digit, train_size=data_size,
-        test_x=test_x, test_y=test_y, test_y_float=test_y.float(), test_digit=test_digit, test_size=data_size,
+        train_x=train_x, train_y=train_y, train_digit=train_digit, train_size=data_size,
+        test_x=test_x, test_y=test_y, test_digit=test_digit, test_size=data_size,
     )
+
+    # the whole dataset easily fits in memory on the device, moving it once here means the
+    # training loop and the data augmentations never pay for host<->device copies again
+    data.to(get_device())
+
+    # normalizing after the move runs the statistics on the device and works in-place
+    normalize(data.train_x, data.test_x, input_normalization)
     return data
 
 
@@ -2,7 +2,7 @@ from abc import ABC, abstractmethod
 
 import torch
 
-from hyper.core import HyperCube, ones_like, GradFn
+from hyper.core import HyperCube, GradFn
 
 
 class Loss(ABC):
@@ -68,7 +68,7 @@ class LossBCEGradFn(GradFn):
     def backward(self, output_grad):
         x = self.input_.value
         y = self.target.value
-        eps = ones_like(x) * 1e-12
-        batch_size = len(self.input_.value)
-        input_grad = ((x - y) / ((1 - x) * x).maximum(eps)) * output_grad / batch_size
+        batch_size = len(x)
+        # clamp with a scalar bound instead of allocating an eps tensor
+        input_grad = (x - y) / ((1 - x) * x).clamp(min=1e-12) * (output_grad / batch_size)
         self.input_.backward(input_grad)
@@ -80,29 +80,52 @@ class Data:
 
 HEATMAP_SIZE = 1000
 
+# the heatmap evaluation grid never changes, so it's built once on first use
+_HEATMAP_INPUT = None
 
-def calculate_heatmap(model, ):
-    bound = math.sqrt(3)
-    image_input_x, image_input_y = torch.meshgrid(
-        torch.linspace(-bound, bound, HEATMAP_SIZE),
-        torch.linspace(-bound, bound, HEATMAP_SIZE)
-    )
-    image_input = torch.cat([image_input_x.reshape(-1, 1), image_input_y.reshape(-1, 1)], dim=1)
-    image_output = model(HyperCube(image_input))
+
+def calculate_heatmap(model):
+    global _HEATMAP_INPUT
+
+    if _HEATMAP_INPUT is None:
+        bound = math.sqrt(3)
+        lin = torch.linspace(-bound, bound, HEATMAP_SIZE)
+        # explicit "ij" indexing matches the old default and silences the torch warning
+        image_input_x, image_input_y = torch.meshgrid(lin, lin, indexing="ij")
+
+        # fill a single preallocated (N, 2) tensor instead of cat'ing two reshaped columns
+        _HEATMAP_INPUT = torch.empty(HEATMAP_SIZE * HEATMAP_SIZE, 2)
+        _HEATMAP_INPUT[:, 0] = image_input_x.reshape(-1)
+        _HEATMAP_INPUT[:, 1] = image_input_y.reshape(-1)
+
+    image_output = model(HyperCube(_HEATMAP_INPUT))
 
     return image_output.value.reshape(-1, HEATMAP_SIZE).rot90(k=1)
 
 
-def to_movie_frame(heatmap):
-    heatmap = heatmap[:, :, None]
+def _build_movie_lut():
+    """ Build the 256-entry blue -> yellow -> red colormap LUT used by `to_movie_frame`. """
+    t = torch.linspace(0, 1, 256)[:, None]
 
-    blue = torch.tensor([0.0, 0.0, 1.0]).view(1, 1, 3)
-    yellow = torch.tensor([1.0, 1.0, 0.0]).view(1, 1, 3)
-    red = torch.tensor([1.0, 0.0, 0.0]).view(1, 1, 3)
+    blue = torch.tensor([0.0, 0.0, 1.0])
+    yellow = torch.tensor([1.0, 1.0, 0.0])
+    red = torch.tensor([1.0, 0.0, 0.0])
 
-    result = (heatmap <= 0.5) * blue.lerp(yellow, (2 * heatmap)) + \
-             (heatmap > 0.5) * yellow.lerp(red, (2 * heatmap) - 1)
-    return (result * 255).type(torch.uint8)
+    lut = torch.where(
+        t <= 0.5,
+        blue.lerp(yellow, (2 * t).clamp(0, 1)),
+        yellow.lerp(red, (2 * t - 1).clamp(0, 1)),
+    )
+    return (lut * 255).type(torch.uint8)
+
+
+MOVIE_LUT = _build_movie_lut()
+
+
+def to_movie_frame(heatmap):
+    # quantize to the LUT index, a frame then becomes a single gather instead of two lerps and a blend
+    index = (heatmap.clamp(0, 1) * 255).long()
+    return MOVIE_LUT[index]
 
 
 PLOT_LEGEND = ["Train_error", "Test_error", "Train_loss", "Test_loss"]
@@ -114,6 +137,8 @@ def train_model(model, optimizer, loss_func, data, epoch, log_epochs: bool, make
     log_epochs determines whether intermediate train and test losses are printed.
     """
 
+    # everything in this framework lives on the cpu, so these are plain host buffers,
+    # pinned memory and async copies have nothing to overlap with here
     plot_data = torch.empty(epoch, len(PLOT_LEGEND))
     movie_data = torch.empty(epoch, HEATMAP_SIZE, HEATMAP_SIZE, 3, dtype=torch.uint8) if make_movie else None
 
@@ -123,8 +148,11 @@ def train_model(model, optimizer, loss_func, data, epoch, log_epochs: bool, make
         y_train = model(data.train_x)
         cost_train, error_train = evaluate_model(y_train, data.train_y, loss_func)
 
-        y_test = model(data.test_x)
-        cost_test, error_test = evaluate_model(y_test, data.test_y, loss_func)
+        # the test pass is evaluation only, inference_mode skips the autograd bookkeeping torch
+        # would otherwise do for the tensors created here (our own backward never runs on it)
+        with torch.inference_mode():
+            y_test = model(data.test_x)
+            cost_test, error_test = evaluate_model(y_test, data.test_y, loss_func)
 
         # Save values for data plotting
         plot_data[e, 0] = error_train
@@ -147,7 +175,7 @@ def train_model(model, optimizer, loss_func, data, epoch, log_epochs: bool, make
             )
 
         if make_movie:
-            movie_data[e, :, :] = to_movie_frame(calculate_heatmap(model))
+            movie_data[e] = to_movie_frame(calculate_heatmap(model))
 
     return plot_data, movie_data
 